@@ -39,10 +39,12 @@ def produce_panel_for_figure_2(structure, b, c, mutation_rates_exact,
 	save_data(mutation_rates_exact, os.path.join(directory, 'mutation_rates_exact.pickle'))
 	save_data(mutation_rates_simulation, os.path.join(directory, 'mutation_rates_simulation.pickle'))
 	
+	# reuse a single figure across benefits, clearing it before each plot
+	f, ax = plt.subplots(figsize=(10, 10))
 	for benefit in b:
 		print('Running exact calculations for benefit %s.' % benefit)
 		start_time = time.time()
-		# run exact calculations (replace 'spsolve' with 'lsqr' to use a least-squares solver)
+		# run exact calculations (replace 'spsolve' with 'lsqr' to use a least-squares solver, or with 'bicgstab' or 'cg' for an iterative solver)
 		ff_exact, pp_exact = exact.run_calculations(structure, benefit, c, mutation_rates_exact, solver='spsolve')
 		print('Total time taken: %s seconds.' % (np.round(time.time() - start_time, 3)))
 
@@ -64,17 +66,17 @@ def produce_panel_for_figure_2(structure, b, c, mutation_rates_exact,
 					'benefits/{:e}/'.format(benefit)+good_type+'-goods/'+data_type+'.pickle'))
 
 		# plot exact and simulation results together
-		f = plt.figure(figsize=(10, 10))
-		plt.axhline(y=0, xmin=0, xmax=1, color=(0, 0, 0), linestyle='--')
-		plt.plot(mutation_rates_exact, ff_exact, color=(0, 0.6, 0.6), linewidth=3)
-		plt.plot(mutation_rates_exact, pp_exact, color=(0.6, 0, 0.6), linewidth=3)
-		plt.scatter(mutation_rates_simulation, (ff_simulation-0.5)/selection_intensity, color=(0, 0.6, 0.6))
-		plt.scatter(mutation_rates_simulation, (pp_simulation-0.5)/selection_intensity, color=(0.6, 0, 0.6))
-		plt.xticks(fontsize=20)
-		plt.yticks(fontsize=20)
-		plt.xlim([0, 1])
-		plt.grid()
+		ax.clear()
+		ax.axhline(y=0, xmin=0, xmax=1, color=(0, 0, 0), linestyle='--')
+		ax.plot(mutation_rates_exact, ff_exact, color=(0, 0.6, 0.6), linewidth=3)
+		ax.plot(mutation_rates_exact, pp_exact, color=(0.6, 0, 0.6), linewidth=3)
+		ax.scatter(mutation_rates_simulation, (ff_simulation-0.5)/selection_intensity, color=(0, 0.6, 0.6))
+		ax.scatter(mutation_rates_simulation, (pp_simulation-0.5)/selection_intensity, color=(0.6, 0, 0.6))
+		ax.tick_params(labelsize=20)
+		ax.set_xlim([0, 1])
+		ax.grid()
 		f.savefig(os.path.join(directory, 'benefits/'+'{:e}/'.format(benefit)+'dataplot.pdf'), bbox_inches='tight')
+	plt.close(f)
 
 if __name__=='__main__':
 	# output directories
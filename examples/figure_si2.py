@@ -41,10 +41,12 @@ def produce_panel_for_figure_si2(structure, b, c, mutation_rates_exact,
 
 	print('Running exact calculations.')
 	start_time = time.time()
-	# run exact calculations (replace 'spsolve' with 'lsqr' to use a least-squares solver)
+	# run exact calculations (replace 'spsolve' with 'lsqr' to use a least-squares solver, or with 'bicgstab' or 'cg' for an iterative solver)
 	ff_exact, pp_exact = exact.run_calculations(structure, b, c, mutation_rates_exact, solver='spsolve')
 	print('Total time taken: %s seconds.' % (np.round(time.time() - start_time, 3)))
 
+	# reuse a single figure across selection intensities, clearing it before each plot
+	f, ax = plt.subplots(figsize=(10, 10))
 	for selection_intensity in selection_intensities:
 		print('Running simulations for selection intensity %s.' % selection_intensity)
 		start_time = time.time()
@@ -62,18 +64,19 @@ def produce_panel_for_figure_si2(structure, b, c, mutation_rates_exact,
 				save_data(frequencies, os.path.join(directory, 'selection_intensities/{:e}/'.format(selection_intensity)+good_type+'-goods/'+data_type+'.pickle'))
 
 		# plot exact and simulation results together
-		f = plt.figure(figsize=(10, 10))
-		plt.axhline(y=0.5, xmin=0, xmax=1, color=(0, 0, 0), linestyle='--')
-		plt.plot(mutation_rates_exact, 0.5+selection_intensity*ff_exact, color=(0, 0.6, 0.6), linewidth=3)
-		plt.plot(mutation_rates_exact, 0.5+selection_intensity*pp_exact, color=(0.6, 0, 0.6), linewidth=3)
-		plt.scatter(mutation_rates_simulation, ff_simulation, color=(0, 0.6, 0.6))
-		plt.scatter(mutation_rates_simulation, pp_simulation, color=(0.6, 0, 0.6))
-		plt.xticks(fontsize=20)
-		plt.yticks([0, 0.25, 0.5, 0.75, 1], fontsize=20)
-		plt.xlim([0, 1])
-		plt.ylim([0, 1])
-		plt.grid()
+		ax.clear()
+		ax.axhline(y=0.5, xmin=0, xmax=1, color=(0, 0, 0), linestyle='--')
+		ax.plot(mutation_rates_exact, 0.5+selection_intensity*ff_exact, color=(0, 0.6, 0.6), linewidth=3)
+		ax.plot(mutation_rates_exact, 0.5+selection_intensity*pp_exact, color=(0.6, 0, 0.6), linewidth=3)
+		ax.scatter(mutation_rates_simulation, ff_simulation, color=(0, 0.6, 0.6))
+		ax.scatter(mutation_rates_simulation, pp_simulation, color=(0.6, 0, 0.6))
+		ax.tick_params(labelsize=20)
+		ax.set_yticks([0, 0.25, 0.5, 0.75, 1])
+		ax.set_xlim([0, 1])
+		ax.set_ylim([0, 1])
+		ax.grid()
 		f.savefig(os.path.join(directory, 'selection_intensities/{:e}/'.format(selection_intensity)+'dataplot.pdf'), bbox_inches='tight')
+	plt.close(f)
 
 if __name__=='__main__':
 	# output directories
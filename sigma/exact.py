@@ -5,6 +5,18 @@ import os
 from joblib import Parallel, delayed
 from scipy import sparse as sp
 
+try:
+	from pypardiso import spsolve as pardiso_spsolve
+	_PARDISO_AVAILABLE = True
+except ImportError:
+	_PARDISO_AVAILABLE = False
+
+try:
+	import scikits.umfpack
+	_UMFPACK_AVAILABLE = True
+except ImportError:
+	_UMFPACK_AVAILABLE = False
+
 def run_calculations(structure, b, c, mutation_rates, solver='spsolve', verbose=False):
 	'''
 	Main calculation runner
@@ -32,17 +44,26 @@ def run_calculations(structure, b, c, mutation_rates, solver='spsolve', verbose=
 		An array of the first-order selection effects for pp-goods, one for each mutation rate
 	'''
 
-	def run_single_calculation(mutation_rate):
+	# everything except the mutation rate is shared, so calculate it once for all workers
+	w, A, e, d = random_walk_probabilities(structure)
+	m = marginal_fecundity_effects(A)
+	lw_operator = location_weights_operator(e, d)
+	ibs_operator = identity_by_state_operator(A)
+	A_dense = A.toarray()
+
+	def run_single_calculation(mutation_rate, w, A, A_dense, e, d, m, lw_operator, ibs_operator):
 		if verbose:
 			print(mutation_rate)
-		K1, K2, w, A = structure_coefficients(structure, mutation_rate, solver)
-		ff = frequency_derivative(K1, K2, w, A, b, c, 'ff')
-		pp = frequency_derivative(K1, K2, w, A, b, c, 'pp')
+		K1, K2 = structure_coefficients(A, e, d, m, mutation_rate, solver, lw_operator, ibs_operator)
+		ff = frequency_derivative(K1, K2, w, A_dense, b, c, 'ff')
+		pp = frequency_derivative(K1, K2, w, A_dense, b, c, 'pp')
 		return ff, pp
 
-	# run calculations in parallel, using the maximum number of cpu cores
-	selection_effects = np.asarray(Parallel(n_jobs=os.cpu_count())(
-		delayed(run_single_calculation)(mutation_rate) for mutation_rate in mutation_rates))
+	# run calculations in parallel, using the maximum number of cpu cores (large shared arrays 
+	# are memory-mapped into the workers rather than pickled for every task)
+	selection_effects = np.asarray(Parallel(n_jobs=os.cpu_count(), backend='loky', batch_size='auto', 
+		max_nbytes='50M', mmap_mode='r')(delayed(run_single_calculation)(mutation_rate, w, A, A_dense, 
+		e, d, m, lw_operator, ibs_operator) for mutation_rate in mutation_rates))
 	return selection_effects[:, 0], selection_effects[:, 1]
 
 def random_walk_probabilities(structure):
@@ -67,13 +88,33 @@ def random_walk_probabilities(structure):
 		A vector of the death probabilities, one for each location
 	'''
 
-	w = nx.adjacency_matrix(structure)
+	w = sp.csr_matrix(nx.adjacency_matrix(structure))
 	A = w.multiply(sp.csr_matrix(1/np.sum(w, axis=1)))
 	e = A.transpose()/A.shape[0]
 	d = np.asarray(np.sum(e, axis=0)).ravel()
 	return w, A, e, d
 
-def location_weights(e, d, mutation_rate):
+def location_weights_operator(e, d):
+	'''
+	Calculates the part of the system for location weights that does not depend on the mutation rate
+
+	Parameters
+	----------
+	e: scipy.sparse.csc.csc_matrix
+		A matrix of the marginal transmission probabilities
+	d: numpy.ndarray
+		A vector of the death probabilities, one for each location
+
+	Returns
+	-------
+	numpy.ndarray
+		The dense matrix of marginal transmission probabilities, transposed and divided by the 
+		death probability of the parent
+	'''
+
+	return e.toarray().T/d.reshape(1, -1)
+
+def location_weights(e, d, mutation_rate, lw_operator=None):
 	'''
 	Calculates mutation-weighted reproductive values
 
@@ -85,6 +126,8 @@ def location_weights(e, d, mutation_rate):
 		A vector of the death probabilities, one for each location
 	mutation_rate: float
 		The per-capita mutation probability
+	lw_operator: numpy.ndarray
+		The output of location_weights_operator for e and d, if already calculated (default: None)
 
 	Returns
 	-------
@@ -92,14 +135,144 @@ def location_weights(e, d, mutation_rate):
 		The vector of mutation-weighted reproductive values
 	'''
 
+	# the system has only N unknowns, so it is solved densely
 	population_size = e.shape[0]
-	tilde_A = sp.eye(population_size, format='csr')-(1-mutation_rate)*(
-		e.transpose().multiply(sp.csr_matrix(1/np.transpose(d))))
-	tilde_v = sp.linalg.spsolve(tilde_A.transpose(), 
-		mutation_rate*np.ones((population_size, 1))/population_size)
-	return np.divide(tilde_v.transpose(), d)
+	if lw_operator is None:
+		lw_operator = location_weights_operator(e, d)
+	tilde_A = np.eye(population_size)-(1-mutation_rate)*lw_operator
+	tilde_v = np.linalg.solve(tilde_A.T, mutation_rate*np.ones((population_size,))/population_size)
+	return np.divide(tilde_v, d)
+
+def identity_by_state_operator(A):
+	'''
+	Calculates the part of the identity-by-state system that does not depend on the mutation rate
 
-def identity_by_state_probabilities(A, mutation_rate, solver):
+	Parameters
+	----------
+	A: scipy.sparse.csr.csr_matrix
+		The transition matrix for the ancestral random walk
+
+	Returns
+	-------
+	scipy.sparse.csc.csc_matrix
+		The operator (1/2)(kron(I, A)+kron(A, I)), with the rows of identical pairs of locations 
+		removed and with explicit entries on the diagonal
+	numpy.ndarray
+		The positions of the diagonal entries in the data array of the operator
+	numpy.ndarray
+		The rows of the operator corresponding to identical pairs of locations
+	'''
+
+	population_size = A.shape[0]
+	pinned = np.arange(0, population_size)*(population_size+1)
+	blocks = np.arange(0, population_size)
+
+	# assemble the entries of kron(I, A) (a copy of A in each diagonal block) and kron(A, I) (each 
+	# entry of A spread along the diagonal of its block) directly, rather than through sp.kron
+	A = sp.coo_matrix(A)
+	row = np.concatenate(((blocks[:, None]*population_size+A.row[None, :]).ravel(), 
+		(A.row[:, None]*population_size+blocks[None, :]).ravel()))
+	col = np.concatenate(((blocks[:, None]*population_size+A.col[None, :]).ravel(), 
+		(A.col[:, None]*population_size+blocks[None, :]).ravel()))
+	data = (1/2)*np.concatenate((np.tile(A.data, population_size), np.repeat(A.data, population_size)))
+
+	# drop the rows of identical pairs (multiples of N+1) and add explicit diagonal entries, so 
+	# that I-(1-mutation_rate)*L shares the sparsity pattern of L, in one conversion from COO
+	keep = row%(population_size+1)!=0
+	L = sp.csc_matrix((np.concatenate((data[keep], np.zeros((population_size**2,)))), 
+		(np.concatenate((row[keep], np.arange(0, population_size**2))), 
+		np.concatenate((col[keep], np.arange(0, population_size**2))))), 
+		shape=(population_size**2, population_size**2))
+	L.sum_duplicates()
+	columns = np.repeat(np.arange(0, population_size**2), np.diff(L.indptr))
+	diagonal = np.flatnonzero(L.indices==columns)
+	return L, diagonal, pinned
+
+def identity_by_state_linear_operator(A, mutation_rate):
+	'''
+	Represents the identity-by-state system without forming the Kronecker product
+
+	Parameters
+	----------
+	A: scipy.sparse.csr.csr_matrix
+		The transition matrix for the ancestral random walk
+	mutation_rate: float
+		The per-capita mutation probability
+
+	Returns
+	-------
+	scipy.sparse.linalg.LinearOperator
+		The map X -> X-((1-mutation_rate)/2)(AX+XA^T) acting on column-stacked matrices, with 
+		the diagonal of X left fixed
+	'''
+
+	population_size = A.shape[0]
+	pinned = np.arange(0, population_size)*(population_size+1)
+
+	def matvec(x):
+		X = np.reshape(x, (population_size, population_size), order='F')
+		y = np.ravel(X-(1-mutation_rate)*(1/2)*(A@X+(A@(X.T)).T), order='F')
+		y[pinned] = np.ravel(x)[pinned]
+		return y
+
+	return sp.linalg.LinearOperator((population_size**2, population_size**2), matvec=matvec, dtype=float)
+
+def identity_by_state_symmetric_operator(A, mutation_rate):
+	'''
+	Represents the identity-by-state system as a symmetric positive-definite system, which is 
+	possible when the ancestral random walk is reversible (as it is on undirected graphs)
+
+	Parameters
+	----------
+	A: scipy.sparse.csr.csr_matrix
+		The transition matrix for the ancestral random walk
+	mutation_rate: float
+		The per-capita mutation probability
+
+	Returns
+	-------
+	scipy.sparse.linalg.LinearOperator
+		The map Y -> Y-((1-mutation_rate)/2)(SY+YS) restricted to distinct pairs of locations, 
+		where S is the symmetrized random walk and Y holds the rescaled probabilities
+	scipy.sparse.dia.dia_matrix
+		The Jacobi preconditioner for the operator
+	numpy.ndarray
+		The right-hand side of the rescaled system
+	numpy.ndarray
+		The square roots of the stationary distribution, by which the probabilities are rescaled
+	'''
+
+	population_size = A.shape[0]
+	A_dense = A.toarray()
+
+	# find the stationary distribution, pi, and check detailed balance
+	P = np.eye(population_size)-A_dense.T
+	P[-1, :] = 1
+	pi = np.linalg.solve(P, np.eye(population_size)[:, -1])
+	flux = pi.reshape(-1, 1)*A_dense
+	if not np.allclose(flux, flux.T):
+		raise ValueError('The ancestral random walk must be reversible.')
+
+	# rescaling phi by the outer product of the square roots of pi symmetrizes the random walk
+	scaling = np.sqrt(pi)
+	S = scaling.reshape(-1, 1)*A_dense/scaling.reshape(1, -1)
+	S = (S+S.T)/2
+	distinct = ~np.eye(population_size, dtype=bool)
+
+	def matvec(y):
+		Y = np.reshape(y, (population_size, population_size), order='F')
+		Z = np.where(distinct, Y, 0)
+		return np.ravel(np.where(distinct, Z-(1-mutation_rate)*(1/2)*(S@Z+Z@S), Y), order='F')
+
+	operator = sp.linalg.LinearOperator((population_size**2, population_size**2), 
+		matvec=matvec, rmatvec=matvec, dtype=float)
+	jacobi = sp.diags(1/np.ravel(np.where(distinct, 1-(1-mutation_rate)*(1/2)*(
+		np.diag(S).reshape(-1, 1)+np.diag(S).reshape(1, -1)), 1), order='F'))
+	b = np.ravel(np.where(distinct, np.outer(scaling, scaling)*mutation_rate*(1/2)
+		+(1-mutation_rate)*(1/2)*S*(pi.reshape(-1, 1)+pi.reshape(1, -1)), 0), order='F')
+	return operator, jacobi, b, scaling
+
+def identity_by_state_probabilities(A, mutation_rate, solver, ibs_operator=None):
 	'''
 	Calculates probabilities of identity by state under neutral drift
 
@@ -111,6 +284,8 @@ def identity_by_state_probabilities(A, mutation_rate, solver):
 		The per-capita mutation probability
 	solver: str
 		The numerical solver for identity by state
+	ibs_operator: tuple
+		The output of identity_by_state_operator for A, if already calculated (default: None)
 
 	Returns
 	-------
@@ -118,23 +293,51 @@ def identity_by_state_probabilities(A, mutation_rate, solver):
 		The matrix of pairwise identity-by-state probabilities
 	'''
 
-	population_size = A.shape[0]
-	M = sp.eye(population_size**2, format='csr')-(1-mutation_rate)*(1/2)*(sp.kron(sp.eye(
-		population_size, format='csr'), A)+sp.kron(A, sp.eye(population_size, format='csr')))
-	b = mutation_rate*(1/2)*np.ones([population_size**2, 1])
-	for i in range(0, population_size):
-		row = i*population_size+i
-		M[row, M[row, :].nonzero()[1]] = 0
-		M[row, row] = 1
-		b[row] = 1
 	if not isinstance(solver, str):
 		raise TypeError('Solver must be a string.')
-	elif not solver.lower() in ['spsolve', 'lsqr']:
-		raise ValueError('Solver must be \'spsolve\' or \'lsqr\'.')
+	elif not solver.lower() in ['spsolve', 'lsqr', 'bicgstab', 'cg']:
+		raise ValueError('Solver must be \'spsolve\', \'lsqr\', \'bicgstab\', or \'cg\'.')
+	population_size = A.shape[0]
+	if solver.lower()=='cg':
+		# solve for the distinct pairs only, in the rescaled variables where the system is symmetric
+		M, M_inv, b, scaling = identity_by_state_symmetric_operator(A, mutation_rate)
+		y, info = sp.linalg.cg(M, b, M=M_inv, rtol=1e-10, atol=0, maxiter=10*population_size**2)
+		if info!=0:
+			raise RuntimeError('The cg solver did not converge.')
+		x = y.reshape((population_size, population_size), order='F')/np.outer(scaling, scaling)
+		np.fill_diagonal(x, 1)
+		return x
+	if solver.lower()=='bicgstab':
+		# iterate on the N-by-N matrix directly, which avoids the N^2-by-N^2 Kronecker operator
+		b = mutation_rate*(1/2)*np.ones((population_size**2,))
+		b[np.arange(0, population_size)*(population_size+1)] = 1
+		x, info = sp.linalg.bicgstab(identity_by_state_linear_operator(A, mutation_rate), 
+			b, rtol=1e-10, atol=0, maxiter=10*population_size**2)
+		if info!=0:
+			raise RuntimeError('The bicgstab solver did not converge.')
+		return x.reshape((population_size, population_size), order='F')
+	if ibs_operator is None:
+		ibs_operator = identity_by_state_operator(A)
+	L, diagonal, pinned = ibs_operator
+
+	# only the data of the system matrix changes with the mutation rate
+	data = -(1-mutation_rate)*L.data
+	data[diagonal] += 1
+	M = sp.csc_matrix((data, L.indices, L.indptr), shape=L.shape)
+	b = mutation_rate*(1/2)*np.ones([population_size**2, 1])
+	b[pinned] = 1
 	if solver.lower()=='spsolve':
-		x = sp.linalg.spsolve(M, b)
+		# prefer PARDISO, then UMFPACK, when installed; otherwise use SuperLU with an ordering 
+		# suited to the structurally symmetric pattern of M (much faster than the default on 
+		# tree-like structures, slightly slower on denser ones)
+		if _PARDISO_AVAILABLE:
+			x = pardiso_spsolve(M.tocsr(), b)
+		elif _UMFPACK_AVAILABLE:
+			x = sp.linalg.spsolve(M, b, use_umfpack=True)
+		else:
+			x = sp.linalg.spsolve(M, b, permc_spec='MMD_AT_PLUS_A')
 	else:
-		x = sp.linalg.lsqr(M, b)[0]
+		x = sp.linalg.lsqr(M, b, atol=1e-10, btol=1e-10)[0]
 	x = np.reshape(x, (population_size**2, 1))
 	return x.reshape((population_size, population_size), order='F')
 
@@ -149,29 +352,39 @@ def marginal_fecundity_effects(A):
 
 	Returns
 	-------
-	dict
-		The effects of fecundities on marginal transmission probabilities
+	numpy.ndarray
+		The effects of fecundities on marginal transmission probabilities, stacked so that m[i] 
+		is the effect of the fecundity at location i
 	'''
 
 	population_size = A.shape[0]
-	m = {}
-	for i in range(0, population_size):
-		m[i] = -A.multiply(A[:, i])/population_size
-		m[i][:, i] = m[i][:, i] + A[:, i]/population_size
+	A_dense = A.toarray()
+	m = -(A_dense[None, :, :]*A_dense.T[:, :, None])/population_size
+	np.einsum('iki->ik', m)[:] += A_dense.T/population_size
 	return m
 
-def structure_coefficients(structure, mutation_rate, solver):
+def structure_coefficients(A, e, d, m, mutation_rate, solver, lw_operator=None, ibs_operator=None):
 	'''
 	Calculates the structure coefficients
 
 	Parameters
 	----------
-	structure: networkx.classes.graph.Graph
-		The spatial structure of the population
+	A: scipy.sparse.csr.csr_matrix
+		The transition matrix for the ancestral random walk
+	e: scipy.sparse.csc.csc_matrix
+		A matrix of the marginal transmission probabilities
+	d: numpy.ndarray
+		A vector of the death probabilities, one for each location
+	m: numpy.ndarray
+		The effects of fecundities on marginal transmission probabilities
 	mutation_rate: float
 		The per-capita mutation probability
 	solver: str
 		The numerical solver for identity by state
+	lw_operator: numpy.ndarray
+		The output of location_weights_operator, if already calculated (default: None)
+	ibs_operator: tuple
+		The output of identity_by_state_operator, if already calculated (default: None)
 
 	Returns
 	-------
@@ -179,27 +392,23 @@ def structure_coefficients(structure, mutation_rate, solver):
 		The matrix of structure coefficients, K1
 	numpy.ndarray
 		The matrix of structure coefficients, K2
-	numpy.ndarray
-		The dense representation of the adjacency matrix
-	numpy.ndarray
-		The dense representation of the ancestral random walk
 	'''
 
-	w, A, e, d = random_walk_probabilities(structure)
-	m = marginal_fecundity_effects(A)
-	v = location_weights(e, d, mutation_rate).reshape(1, -1)
-	phi = identity_by_state_probabilities(A, mutation_rate, solver)
-	K1, K2 = np.zeros(e.shape), np.zeros(e.shape)
-	for j in range(0, e.shape[0]):
-		mj = np.asarray(m[j].todense())
-		term1 = (v@(mj*phi)).T
-		term2 = ((((v.T)*mj)).T)@phi
-		term3 = ((v@mj)*phi[j, :].reshape(1, -1)).T
-		term4 = ((v@mj).T)@phi[j, :].reshape(1, -1)
-		term5 = np.sum(v@mj)/e.shape[0]
-		K1 += (1/(2*mutation_rate))*(-(term1+term2)+(1-mutation_rate)*(term3+term4)+term5)
-		K2 += (1/(2*mutation_rate))*(-(term1-term2)+(1-mutation_rate)*(term3-term4))
-	return K1, K2, np.asarray(w.todense()), np.asarray(A.todense())
+	v = location_weights(e, d, mutation_rate, lw_operator).ravel()
+	phi = identity_by_state_probabilities(A, mutation_rate, solver, ibs_operator)
+
+	# contract over all locations j at once, rather than one marginal fecundity effect at a time; 
+	# the first two terms are linear in m[j], so they only need the sum of the effects over j
+	m_total = np.sum(m, axis=0)
+	vm = np.tensordot(v, m, axes=(0, 1))
+	term1 = (v@(m_total*phi)).reshape(-1, 1)
+	term2 = ((v.reshape(-1, 1)*m_total).T)@phi
+	term3 = np.sum(vm*phi, axis=0).reshape(-1, 1)
+	term4 = (vm.T)@phi
+	term5 = np.sum(vm)/e.shape[0]
+	K1 = (1/(2*mutation_rate))*(-(term1+term2)+(1-mutation_rate)*(term3+term4)+term5)
+	K2 = (1/(2*mutation_rate))*(-(term1-term2)+(1-mutation_rate)*(term3-term4))
+	return K1, K2
 
 def frequency_derivative(K1, K2, w, A, b, c, social_good):
 	'''
@@ -211,7 +420,7 @@ def frequency_derivative(K1, K2, w, A, b, c, social_good):
 		The matrix of structure coefficients, K1
 	K2: numpy.ndarray
 		The matrix of structure coefficients, K2
-	w: numpy.ndarray
+	w: scipy.sparse.csr.csr_matrix
 		The adjacency matrix for the structure
 	A: numpy.ndarray
 		The transition matrix for the ancestral random walk
@@ -233,7 +442,9 @@ def frequency_derivative(K1, K2, w, A, b, c, social_good):
 	elif not social_good.lower() in ['ff', 'pp']:
 		raise ValueError('Social good must be \'ff\' or \'pp\'.')
 	if social_good.lower()=='ff':
-		return (1/2)*(np.sum(np.diag(A@(K1-K2)))*b-np.sum(np.diag((A.T)@(K1+K2)))*c)
+		# only the traces of A(K1-K2) and (A^T)(K1+K2) are needed, not the full products
+		return (1/2)*(np.einsum('ij,ji->', A, K1-K2)*b-np.einsum('ji,ji->', A, K1+K2)*c)
 	else:
-		K1_pp, K2_pp = np.sum(np.multiply(K1, w)), np.sum(np.multiply(K2, w))
+		# sum only over the edges of the structure, which are the nonzero entries of w
+		K1_pp, K2_pp = w.multiply(K1).sum(), w.multiply(K2).sum()
 		return (1/2)*((K1_pp-K2_pp)*b-(K1_pp+K2_pp)*c)
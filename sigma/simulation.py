@@ -4,6 +4,12 @@ import numpy as np
 import os
 from joblib import Parallel, delayed
 
+try:
+	from numba import njit
+	_NUMBA_AVAILABLE = True
+except ImportError:
+	_NUMBA_AVAILABLE = False
+
 def run_simulations(structure, social_good, b, c, mutation_rates, 
 	selection_intensity, number_of_updates, trait=1, verbose=False):
 	'''
@@ -36,18 +42,43 @@ def run_simulations(structure, social_good, b, c, mutation_rates,
 		An array of the mean frequencies of the trait, one for each mutation rate
 	'''
 
-	def run_single_simulation(mutation_rate):
+	# convert the graph once, so that workers receive plain arrays rather than a pickled graph
+	nbr_indptr, nbr_indices = neighborhoods(structure)
+
+	def run_single_simulation(mutation_rate, nbr_indptr, nbr_indices):
 		if verbose:
 			print(mutation_rate)
-		state = np.random.randint(0, 2, nx.number_of_nodes(structure))
-		pop = Population(structure, state, social_good, b, c, mutation_rate, selection_intensity)
+		state = np.random.randint(0, 2, len(nbr_indptr)-1, dtype=np.uint8)
+		pop = Population.from_csr(nbr_indptr, nbr_indices, state, social_good, b, c, mutation_rate, selection_intensity)
 		return np.mean(pop.update_population(trait, number_of_updates))
 	
-	# run simulations in parallel, using the maximum number of cpu cores
-	simulated_selection_effects = np.asarray(Parallel(n_jobs=os.cpu_count())(
-		delayed(run_single_simulation)(mutation_rate) for mutation_rate in mutation_rates))
+	# run simulations in parallel, using the maximum number of cpu cores (the neighborhoods are 
+	# memory-mapped into the workers when large)
+	simulated_selection_effects = np.asarray(Parallel(n_jobs=os.cpu_count(), backend='loky', batch_size='auto', 
+		max_nbytes='1M', mmap_mode='r')(delayed(run_single_simulation)(mutation_rate, nbr_indptr, nbr_indices) 
+		for mutation_rate in mutation_rates))
 	return simulated_selection_effects
 
+def neighborhoods(structure):
+	'''
+	Calculates the neighborhoods of all individuals in compressed sparse row form
+
+	Parameters
+	----------
+	structure: networkx.classes.graph.Graph
+		The spatial structure of the population
+
+	Returns
+	-------
+	numpy.ndarray
+		The index pointers, so that the neighbors of i are nbr_indices[nbr_indptr[i]:nbr_indptr[i+1]]
+	numpy.ndarray
+		The concatenated neighborhoods of all individuals
+	'''
+
+	adjacency = nx.to_scipy_sparse_array(structure, nodelist=range(nx.number_of_nodes(structure)), format='csr')
+	return adjacency.indptr.astype(np.int32), adjacency.indices.astype(np.int32)
+
 class Population(object):
 
 	def __init__(self, structure, state, social_good, b, c, mutation_rate, selection_intensity):
@@ -72,14 +103,57 @@ class Population(object):
 			The intensity of selection
 		'''
 
-		# set the spatial structure and population size (number of nodes in the graph)
-		self._structure = structure
-		self._population_size = nx.number_of_nodes(structure)
+		# set the spatial structure, stored as neighborhoods in compressed sparse row form
+		nbr_indptr, nbr_indices = neighborhoods(structure)
+		self._initialize(nbr_indptr, nbr_indices, state, social_good, b, c, mutation_rate, selection_intensity)
+
+	@classmethod
+	def from_csr(cls, nbr_indptr, nbr_indices, state, social_good, b, c, mutation_rate, selection_intensity):
+		'''
+		Initializes the population from neighborhoods in compressed sparse row form
+
+		Parameters
+		----------
+		nbr_indptr: numpy.ndarray
+			The index pointers of the neighborhoods (see neighborhoods)
+		nbr_indices: numpy.ndarray
+			The concatenated neighborhoods of all individuals (see neighborhoods)
+		state: numpy.ndarray
+			The state of the population (configuration of traits) 
+		social_good: str
+			The social good ('ff' or 'pp') being produced 
+		b: float
+			The benefit generated by producers 
+		c: float
+			The cost incurred by producers 
+		mutation_rate: float
+			The per-capita mutation probability 
+		selection_intensity: float
+			The intensity of selection
+
+		Returns
+		-------
+		Population
+			The population with the given neighborhoods
+		'''
+
+		pop = cls.__new__(cls)
+		pop._initialize(nbr_indptr, nbr_indices, state, social_good, b, c, mutation_rate, selection_intensity)
+		return pop
+
+	def _initialize(self, nbr_indptr, nbr_indices, state, social_good, b, c, mutation_rate, selection_intensity):
+		# set the neighborhoods and population size (number of nodes in the graph)
+		self._nbr_indptr = np.asarray(nbr_indptr, dtype=np.int32)
+		self._nbr_indices = np.asarray(nbr_indices, dtype=np.int32)
+		self._degree = np.diff(self._nbr_indptr).astype(np.int32)
+		self._population_size = len(self._nbr_indptr)-1
+		if np.any(self._degree==0):
+			raise ValueError('Each individual must have at least one neighbor.')
 
 		# set the initial state, meaning a configuration of traits
 		if len(state)!=self._population_size:
 			raise ValueError('Each individual must have a state.')
-		self._state = state
+		self._state = np.ascontiguousarray(state, dtype=np.uint8)
 		
 		# set the type of social good produced in the population, as well as the benefit and cost
 		if not isinstance(social_good, str):
@@ -106,6 +180,20 @@ class Population(object):
 			raise ValueError('Selection intensity must be non-negative.')
 		self._selection_intensity = selection_intensity
 
+		# calculate the payoffs of all individuals, which are then updated as the state changes
+		state = self._state.astype(float)
+		owners = np.repeat(np.arange(0, self._population_size), self._degree)
+		if self._social_good=='ff':
+			self._payoffs = -self._c*state + np.bincount(owners, minlength=self._population_size, 
+				weights=state[self._nbr_indices]*(self._b/self._degree[self._nbr_indices]))
+		else:
+			self._payoffs = -self._c*self._degree*state + np.bincount(owners, minlength=self._population_size, 
+				weights=state[self._nbr_indices]*self._b)
+
+		# set the random number generator and fitness buffer used by the uncompiled update loop
+		self._rng = np.random.default_rng()
+		self._fit_buf = np.empty((np.max(self._degree),))
+
 	def mean_frequency(self, trait):
 		'''
 		Calculates the mean frequency of a trait in the population
@@ -121,8 +209,7 @@ class Population(object):
 			The mean frequency of the trait in the current state of the population
 		'''
 
-		return len([key for key, val in enumerate(self._state) 
-			if val==trait])/self._population_size
+		return np.count_nonzero(self._state==trait)/self._population_size
 
 	def payoff(self, subset):
 		'''
@@ -139,21 +226,16 @@ class Population(object):
 			The payoffs corresponding to the individuals in the subset
 		'''
 
-		payoffs = np.zeros((len(subset),))
-		for individual in subset:
-			neighbors = list(nx.neighbors(self._structure, individual))
-			if self._social_good=='ff':
-				payoffs[subset.index(individual)] = self._state[individual]*(-self._c) + sum([self._state[neighbor]
-					*(self._b/nx.degree(self._structure, neighbor)) for neighbor in neighbors])
-			else:
-				payoffs[subset.index(individual)] = self._state[individual]*(-self._c*nx.degree(self._structure, 
-					individual)) + sum([self._state[neighbor]*(self._b) for neighbor in neighbors])
-		return payoffs
+		return self._payoffs[np.asarray(subset, dtype=int)]
 
 	def update_population(self, trait=None, number_of_updates=1):
 		'''
 		Updates the population using a death-birth rule
 
+		Random numbers come from numba's generator when numba is installed, and from the 
+		population's own numpy Generator otherwise, so np.random.seed does not make updates 
+		reproducible.
+
 		Parameters
 		----------
 		trait: int
@@ -168,23 +250,141 @@ class Population(object):
 		'''
 		
 		mean_frequencies = np.zeros((number_of_updates,))
+		if _NUMBA_AVAILABLE:
+			# run the whole update loop in compiled code (a trait of -1 never occurs)
+			_run_updates(self._state, self._nbr_indptr, self._nbr_indices, self._degree, 
+				self._payoffs, float(self._b), float(self._c), float(self._mutation_rate), 
+				float(self._selection_intensity), 0 if self._social_good=='ff' else 1, 
+				-1 if trait==None else trait, number_of_updates, mean_frequencies)
+			return mean_frequencies if trait!=None else None
+
+		# keep a running count of the trait, which changes only at the location of the death
+		trait_count = np.count_nonzero(self._state==trait)
 		for update in range(0, number_of_updates):
 			# select individual for death, uniformly at random from the population
-			death = np.random.randint(self._population_size)
+			death = self._rng.integers(self._population_size)
 
 			# find neighbors of deceased individual in the graph, as well as their payoffs and fitness
-			neighbors = list(nx.neighbors(self._structure, death))
+			neighbors = self._nbr_indices[self._nbr_indptr[death]:self._nbr_indptr[death+1]]
 			neighbor_payoffs = self.payoff(neighbors)
-			neighbor_fitness = np.exp(self._selection_intensity*
-				(neighbor_payoffs-np.max(neighbor_payoffs)))
+			neighbor_fitness = self._fit_buf[:len(neighbors)]
+			np.subtract(neighbor_payoffs, np.max(neighbor_payoffs), out=neighbor_fitness)
+			neighbor_fitness *= self._selection_intensity
+			np.exp(neighbor_fitness, out=neighbor_fitness)
 
 			# select a neighbor for reproduction, with probability proportional to fitness
-			birth = np.random.choice(neighbors, p=neighbor_fitness/np.sum(neighbor_fitness))
+			cumulative_fitness = np.cumsum(neighbor_fitness, out=neighbor_fitness)
+			birth = neighbors[np.searchsorted(cumulative_fitness, 
+				self._rng.random()*cumulative_fitness[-1], side='right')]
 
 			# subject the offspring to mutation
-			if np.random.rand()<self._mutation_rate/2:
+			old_trait = self._state[death]
+			if self._rng.random()<self._mutation_rate/2:
 				self._state[death] = 1-self._state[birth]
 			else:
 				self._state[death] = self._state[birth]
-			mean_frequencies[update] = self.mean_frequency(trait)
+			trait_count += int(self._state[death]==trait)-int(old_trait==trait)
+
+			# only the payoffs of the replaced individual and its neighbors depend on its trait
+			change = float(self._state[death])-float(old_trait)
+			if change!=0:
+				if self._social_good=='ff':
+					self._payoffs[death] -= change*self._c
+					self._payoffs[neighbors] += change*(self._b/self._degree[death])
+				else:
+					self._payoffs[death] -= change*self._c*self._degree[death]
+					self._payoffs[neighbors] += change*self._b
+			mean_frequencies[update] = trait_count/self._population_size
 		return mean_frequencies if trait!=None else None
+
+def _run_updates(state, nbr_indptr, nbr_indices, degree, payoffs, b, c, mut_rate, delta, 
+	social_good_code, trait, n_updates, out_freq):
+	'''
+	Updates the population in place using a death-birth rule (compiled with numba)
+
+	Parameters
+	----------
+	state: numpy.ndarray
+		The state of the population (configuration of traits), modified in place
+	nbr_indptr: numpy.ndarray
+		The index pointers of the neighborhoods in compressed sparse row form
+	nbr_indices: numpy.ndarray
+		The concatenated neighborhoods in compressed sparse row form
+	degree: numpy.ndarray
+		The degree of each individual
+	payoffs: numpy.ndarray
+		The payoff of each individual, modified in place
+	b: float
+		The benefit generated by producers 
+	c: float
+		The cost incurred by producers 
+	mut_rate: float
+		The per-capita mutation probability 
+	delta: float
+		The intensity of selection
+	social_good_code: int
+		The social good being produced (0 for 'ff' and 1 for 'pp')
+	trait: int
+		The trait value under consideration
+	n_updates: int
+		The number of times to update the population
+	out_freq: numpy.ndarray
+		The array receiving the mean frequency of the trait after each update
+	'''
+
+	population_size = state.shape[0]
+	count = 0
+	for i in range(0, population_size):
+		if state[i]==trait:
+			count += 1
+	fitness = np.empty(np.max(degree))
+	for update in range(0, n_updates):
+		# select individual for death, uniformly at random from the population
+		death = np.random.randint(population_size)
+		start, stop = nbr_indptr[death], nbr_indptr[death+1]
+
+		# look up the payoffs of the neighbors of the deceased individual
+		max_payoff = -np.inf
+		for k in range(start, stop):
+			payoff = payoffs[nbr_indices[k]]
+			fitness[k-start] = payoff
+			if payoff>max_payoff:
+				max_payoff = payoff
+
+		# select a neighbor for reproduction, with probability proportional to fitness
+		total = 0.0
+		for k in range(0, stop-start):
+			total += np.exp(delta*(fitness[k]-max_payoff))
+			fitness[k] = total
+		u = np.random.rand()*total
+		k = 0
+		while k<stop-start-1 and fitness[k]<=u:
+			k += 1
+		birth = nbr_indices[start+k]
+
+		# subject the offspring to mutation
+		old = state[death]
+		if np.random.rand()<mut_rate/2:
+			state[death] = 1-state[birth]
+		else:
+			state[death] = state[birth]
+		if old==trait:
+			count -= 1
+		if state[death]==trait:
+			count += 1
+
+		# only the payoffs of the replaced individual and its neighbors depend on its trait
+		change = float(state[death])-float(old)
+		if change!=0:
+			if social_good_code==0:
+				payoffs[death] -= change*c
+				for k in range(start, stop):
+					payoffs[nbr_indices[k]] += change*(b/degree[death])
+			else:
+				payoffs[death] -= change*c*degree[death]
+				for k in range(start, stop):
+					payoffs[nbr_indices[k]] += change*b
+		out_freq[update] = count/population_size
+
+if _NUMBA_AVAILABLE:
+	_run_updates = njit(cache=True)(_run_updates)
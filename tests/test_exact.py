@@ -2,6 +2,7 @@
 import networkx as nx
 import numpy as np
 import unittest
+from scipy import sparse as sp
 import sigma.exact as exact
 
 class TestExactMethods(unittest.TestCase):
@@ -18,6 +19,11 @@ class TestExactMethods(unittest.TestCase):
 		y = np.asarray(self.e.shape[0]*tilde_v@(np.eye(self.e.shape[0])-(1-self.mutation_rate)*self.A)).ravel()
 		self.assertEqual(np.round(x, self.tol).tolist(), np.round(y, self.tol).tolist())
 
+	def test_location_weights_operator(self):
+		x = exact.location_weights_operator(self.e, self.d)
+		y = self.e.transpose().multiply(sp.csr_matrix(1/self.d)).toarray()
+		self.assertEqual(np.round(x, self.tol).tolist(), np.round(y, self.tol).tolist())
+
 	def test_identity_by_state_probabilities_spsolve(self):
 		x = exact.identity_by_state_probabilities(self.A, self.mutation_rate, 'spsolve')
 		y = self.mutation_rate/2 + ((1-self.mutation_rate)/2)*(self.A@x+(self.A@x).T)
@@ -30,5 +36,38 @@ class TestExactMethods(unittest.TestCase):
 		np.fill_diagonal(y, np.ones((self.A.shape[0],)))
 		self.assertEqual(np.round(x, self.tol).tolist(), np.round(y, self.tol).tolist())
 
+	def test_identity_by_state_probabilities_bicgstab(self):
+		x = exact.identity_by_state_probabilities(self.A, self.mutation_rate, 'bicgstab')
+		y = self.mutation_rate/2 + ((1-self.mutation_rate)/2)*(self.A@x+(self.A@x).T)
+		np.fill_diagonal(y, np.ones((self.A.shape[0],)))
+		self.assertEqual(np.round(x, self.tol).tolist(), np.round(y, self.tol).tolist())
+
+	def test_identity_by_state_probabilities_cg(self):
+		x = exact.identity_by_state_probabilities(self.A, self.mutation_rate, 'cg')
+		y = self.mutation_rate/2 + ((1-self.mutation_rate)/2)*(self.A@x+(self.A@x).T)
+		np.fill_diagonal(y, np.ones((self.A.shape[0],)))
+		self.assertEqual(np.round(x, self.tol).tolist(), np.round(y, self.tol).tolist())
+
+	def test_marginal_fecundity_effects(self):
+		m = exact.marginal_fecundity_effects(self.A)
+		A = self.A.toarray()
+		mj = -A*A[:, [5]]/A.shape[0]
+		mj[:, 5] += A[:, 5]/A.shape[0]
+		self.assertEqual(np.round(m[5], self.tol).tolist(), np.round(mj, self.tol).tolist())
+
+	def test_frequency_derivative_ff(self):
+		A = self.A.toarray()
+		K1, K2 = np.random.rand(*A.shape), np.random.rand(*A.shape)
+		x = exact.frequency_derivative(K1, K2, self.w, A, 2, 1, 'ff')
+		y = (1/2)*(np.trace(A@(K1-K2))*2-np.trace((A.T)@(K1+K2))*1)
+		self.assertEqual(np.round(x, self.tol), np.round(y, self.tol))
+
+	def test_frequency_derivative_pp(self):
+		K1, K2 = np.random.rand(*self.A.shape), np.random.rand(*self.A.shape)
+		x = exact.frequency_derivative(K1, K2, self.w, self.A.toarray(), 2, 1, 'pp')
+		w = self.w.toarray()
+		y = (1/2)*((np.sum(K1*w)-np.sum(K2*w))*2-(np.sum(K1*w)+np.sum(K2*w))*1)
+		self.assertEqual(np.round(x, self.tol), np.round(y, self.tol))
+
 if __name__ == '__main__':
 	unittest.main()
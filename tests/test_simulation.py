@@ -2,7 +2,8 @@
 import networkx as nx
 import numpy as np
 import unittest
-from sigma.simulation import Population
+from unittest import mock
+from sigma.simulation import Population, neighborhoods
 
 class TestPopulation(unittest.TestCase):
 
@@ -23,6 +24,12 @@ class TestPopulation(unittest.TestCase):
 		self.assertRaises(ValueError, lambda: Population(self.structure, bad_state, 
 			self.social_good, self.b, self.c, self.mutation_rate, self.selection_intensity))
 
+	def test_isolated_individual(self):
+		structure = nx.path_graph(5)
+		structure.add_node(5)
+		self.assertRaises(ValueError, lambda: Population(structure, np.zeros((6,)), 
+			self.social_good, self.b, self.c, self.mutation_rate, self.selection_intensity))
+
 	def test_bad_social_good_type(self):
 		bad_social_good_type = 1
 		self.assertRaises(TypeError, lambda: Population(self.structure, self.state, 
@@ -63,5 +70,52 @@ class TestPopulation(unittest.TestCase):
 		payoffs = self.pop.payoff(subset)
 		self.assertEqual(direct_calculation, payoffs.tolist())
 
+	def test_from_csr(self):
+		nbr_indptr, nbr_indices = neighborhoods(self.structure)
+		pop = Population.from_csr(nbr_indptr, nbr_indices, self.state, self.social_good, 
+			self.b, self.c, self.mutation_rate, self.selection_intensity)
+		subset = list(range(0, self.structure.number_of_nodes()))
+		self.assertEqual(pop.payoff(subset).tolist(), self.pop.payoff(subset).tolist())
+
+	def test_update_population(self):
+		mean_frequencies = self.pop.update_population(1, 100)
+		self.assertEqual(mean_frequencies.shape, (100,))
+		self.assertEqual(mean_frequencies[-1], self.pop.mean_frequency(1))
+
+	@mock.patch('sigma.simulation._NUMBA_AVAILABLE', False)
+	def test_update_population_without_numba(self):
+		mean_frequencies = self.pop.update_population(1, 100)
+		self.assertEqual(mean_frequencies.shape, (100,))
+		self.assertEqual(mean_frequencies[-1], self.pop.mean_frequency(1))
+
+	@mock.patch('sigma.simulation._NUMBA_AVAILABLE', False)
+	def test_monomorphic_update_without_numba(self):
+		pop = Population(self.structure, np.ones((self.structure.number_of_nodes(),)), 
+			self.social_good, self.b, self.c, 0, self.selection_intensity)
+		self.assertEqual(pop.update_population(1, 100).tolist(), np.ones((100,)).tolist())
+
+	def test_payoff_after_update(self):
+		self.pop.update_population(1, 1000)
+		pop = Population(self.structure, self.pop._state, self.social_good, 
+			self.b, self.c, self.mutation_rate, self.selection_intensity)
+		subset = list(range(0, self.structure.number_of_nodes()))
+		self.assertEqual(np.round(self.pop.payoff(subset), 10).tolist(), np.round(pop.payoff(subset), 10).tolist())
+
+	@mock.patch('sigma.simulation._NUMBA_AVAILABLE', False)
+	def test_payoff_after_update_without_numba(self):
+		self.pop.update_population(1, 1000)
+		pop = Population(self.structure, self.pop._state, self.social_good, 
+			self.b, self.c, self.mutation_rate, self.selection_intensity)
+		subset = list(range(0, self.structure.number_of_nodes()))
+		self.assertEqual(np.round(self.pop.payoff(subset), 10).tolist(), np.round(pop.payoff(subset), 10).tolist())
+
+	@mock.patch('sigma.simulation._NUMBA_AVAILABLE', False)
+	def test_strong_selection_without_numba(self):
+		pop = Population(self.structure, self.state, 'pp', self.b, self.c, self.mutation_rate, 5.0)
+		self.assertEqual(pop._fit_buf.shape, (max(dict(self.structure.degree()).values()),))
+		mean_frequencies = pop.update_population(1, 1000)
+		self.assertEqual(mean_frequencies[-1], pop.mean_frequency(1))
+		self.assertTrue(np.all((mean_frequencies>=0) & (mean_frequencies<=1)))
+
 if __name__ == '__main__':
 	unittest.main()